@@ -4,11 +4,10 @@ from aiohttp import web
 from botbuilder.core.integration import aiohttp_error_middleware
 
 from botbuilder.schema import Activity
-from handler import adapter, bot_app
+from handler import adapter, bot_app, activity_key, claim_activity, forget_activity
 from config import Config
 
 
-
 routes = web.RouteTableDef()
 
 @routes.post("/api/messages")
@@ -18,8 +17,20 @@ async def on_messages(req: web.Request) -> web.Response:
 
     auth_header = req.headers.get("Authorization", "")
 
+    key = activity_key(activity)
+    if key and not await claim_activity(key):
+        print(f"Skipping redelivered activity {key}", flush=True)
+        return web.Response(status=HTTPStatus.OK)
+
     # Use adapter to handle activity and call bot
-    await adapter.process_activity(activity, auth_header, bot_app.on_turn)
+    try:
+        await adapter.process_activity(activity, auth_header, bot_app.on_turn)
+    except Exception:
+        # Errors raised before the bot runs (e.g. authentication); turn errors
+        # are handled by on_error in handler.py, which forgets the key as well
+        if key:
+            await forget_activity(key)
+        raise
     return web.Response(status=HTTPStatus.OK)
 
 app = web.Application(middlewares=[aiohttp_error_middleware])
@@ -13,4 +13,70 @@ class Config:
     APP_PASSWORD = os.environ.get("BOT_PASSWORD", "")
 
     OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
-    OPENAI_MODEL_NAME='gpt-3.5-turbo' # OpenAI model name. You can use any other model name from OpenAI.
\ No newline at end of file
+    OPENAI_MODEL_NAME='gpt-3.5-turbo' # OpenAI model name. You can use any other model name from OpenAI.
+    OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") # Point at a local mock server for testing
+    OPENAI_REQUESTS_PER_MINUTE = int(os.environ.get("OPENAI_REQUESTS_PER_MINUTE", 500)) # Quota of the whole deployment
+    OPENAI_BURST_SECONDS = 2 # Token bucket holds this many seconds of quota
+
+    # Pooled HTTP client for OpenAI
+    LLM_MAX_CONNECTIONS = 20
+    LLM_MAX_KEEPALIVE_CONNECTIONS = 10
+    LLM_KEEPALIVE_EXPIRY = 30 # seconds
+    LLM_CONNECT_TIMEOUT = 5 # seconds
+    LLM_TIMEOUT = 60 # seconds, per call
+    LLM_MAX_RETRIES = 4 # On 429 / 5xx / connection errors, with jittered backoff
+    LLM_RETRY_BASE_DELAY = 0.5 # seconds
+    LLM_RETRY_MAX_DELAY = 8 # seconds
+
+    # Each Teams turn gets a deadline that the agent loop and tools respect
+    TURN_DEADLINE_SECONDS = int(os.environ.get("TURN_DEADLINE_SECONDS", 120))
+    TURN_FINAL_ANSWER_SECONDS = 10 # Kept back for writing the partial answer
+    TOOL_MIN_SECONDS = 5 # Tools are skipped when less time than this is left
+
+    # Index advisor for the text2sql database: "off", "advise", "allowlist" or "auto"
+    INDEX_ADVISOR_MODE = os.environ.get("INDEX_ADVISOR_MODE", "advise")
+    INDEX_ADVISOR_ALLOWLIST = [
+        "orders.user_id",
+        "order_products.order_id",
+        "order_products.product_id",
+        "carts.user_id",
+        "carts.product_id",
+        "addresses.user_id"
+    ]
+    INDEX_ADVISOR_EVERY = 50 # Tune the indexes every N recorded queries
+    INDEX_ADVISOR_LOG_SIZE = 200 # Max distinct queries kept in the workload log
+
+    ROLLUP_REFRESH_SECONDS = 60 # Min seconds between incremental refreshes of the rollup tables
+    ROLLUP_ORPHAN_WAIT_SECONDS = 600 # How long order lines wait for their order before the rollups skip them
+
+    # Cost guard for model-written SQL
+    QUERY_GUARD_MAX_COST = 50_000_000 # Reject queries estimated to visit more rows than this
+    QUERY_GUARD_CARTESIAN_ROWS = 1_000_000 # Reject joins without a join predicate above this many rows
+    QUERY_GUARD_SEARCH_ROWS = 10 # Estimated rows per indexed lookup
+    QUERY_GUARD_STATS_SECONDS = 60 # Refresh interval of the cached table row counts
+    QUERY_ROW_LIMIT = 1000 # Max rows fetched per query; larger results are flagged as truncated
+
+    # Bot Framework redelivers an activity when the reply is slow; remember processed IDs
+    ACTIVITY_CACHE_SIZE = 10_000
+    ACTIVITY_CACHE_TTL = 15 * 60 # seconds
+
+    # Tool outputs are rendered as header + rows and fitted to a token budget
+    TOOL_OUTPUT_FLOAT_DIGITS = 2 # Max decimals on values >= 1
+    TOOL_OUTPUT_SIGNIFICANT_DIGITS = 3 # Min significant digits, so small probabilities are not rounded to 0
+    TOOL_TOKEN_BUDGET = 800
+    TOOL_TOKEN_BUDGETS = {
+        "run_sqlite_query": 1500,
+        "describe_tables": 1500,
+        "write_report": 2000
+    }
+
+    # CLV is precomputed for every horizon up to this many months
+    CLV_MAX_HORIZON_MONTHS = 36
+    CLV_DISCOUNT_RATE = 0.01 # Monthly discount rate, same as lifetimes' default
+
+    # Shared state for multiple gunicorn workers (SQLite + memory-mapped model files)
+    STATE_DIR = os.environ.get("STATE_DIR", "state")
+    TURN_LEASE_SECONDS = 600 # Turns of one conversation run one at a time across workers
+    MODEL_BUILD_LEASE_SECONDS = 600
+    RESULT_CACHE_TTL = 60 * 60 # seconds
+    RESULT_CACHE_SIZE = 1000
@@ -0,0 +1,9 @@
+import multiprocessing
+import os
+
+# Shared state (conversation memory, caches, model files) lives under STATE_DIR,
+# so any worker can serve any turn and throughput scales with CPU cores
+bind = "0.0.0.0:3978"
+worker_class = "aiohttp.worker.GunicornWebWorker"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+timeout = 600
@@ -1,3 +1,6 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
 import traceback
 import sys
 import json
@@ -6,22 +9,29 @@ import re
 from botbuilder.core import TurnContext, BotFrameworkAdapterSettings, BotFrameworkAdapter, ActivityHandler, MessageFactory
 from botbuilder.schema import Attachment, Activity, ActivityTypes, CardImage, HeroCard
 
-from langchain.chat_models import ChatOpenAI
+from langchain_openai import ChatOpenAI
 from langchain.memory import ConversationBufferMemory
 from langchain.agents import OpenAIFunctionsAgent, AgentExecutor
 from langchain.schema import SystemMessage
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder, HumanMessagePromptTemplate
+from langchain_community.chat_message_histories import SQLChatMessageHistory
+from sqlalchemy import create_engine
 
 from config import Config
+from state import STATE_DB_URL, SharedTTLCache, lease
+import llm_client
 
 from llm_config.system_instruct import SYSTEM_MESSAGE
 
+from tools.output import with_token_budget
 from tools.sql import run_query_tool, describe_tables_tool
 from tools.report import write_report_tool
 from tools.chart import plot_chart_tool
 from tools.analysis import (
     calculate_clv_tool,
+    customer_clv_tool,
     survival_analysis_tool,
+    survival_probability_tool,
     churn_classification_tool,
     uplift_modeling_tool,
     discover_churn_factors_tool
@@ -45,10 +55,19 @@ llm_params = {
 ### 2. Agent setup ====================
 llm = ChatOpenAI(
     openai_api_key=Config.OPENAI_API_KEY,
+    openai_api_base=Config.OPENAI_BASE_URL,
     model_name=Config.OPENAI_MODEL_NAME,
+    http_client=llm_client.http_client,
+    http_async_client=llm_client.async_http_client,
+    request_timeout=llm_client.timeout, # keeps the separate connect timeout
+    max_retries=0, # llm_client retries with jittered backoff within the turn deadline
     **llm_params
 )
 
+# Conversation history lives in the shared state DB, so any worker can serve the next turn.
+# One engine (and connection pool) per worker instead of one per turn
+history_engine = create_engine(STATE_DB_URL)
+
 # Prompt template
 chat_prompt = ChatPromptTemplate(
     messages=[
@@ -59,19 +78,19 @@ chat_prompt = ChatPromptTemplate(
     ]
 )
 
-memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-
-tools = [
+tools = [with_token_budget(llm_client.respect_deadline(tool)) for tool in [
     run_query_tool,
     describe_tables_tool,
     write_report_tool,
     plot_chart_tool,
     calculate_clv_tool,
+    customer_clv_tool,
     survival_analysis_tool,
+    survival_probability_tool,
     churn_classification_tool,
     uplift_modeling_tool,
     discover_churn_factors_tool
-]
+]]
 
 agent = OpenAIFunctionsAgent(
     llm=llm,
@@ -79,12 +98,37 @@ agent = OpenAIFunctionsAgent(
     tools=tools
 )
 
-agent_executor = AgentExecutor(
-    agent=agent,
-    verbose=True,
-    tools=tools,
-    memory=memory
-)
+def build_agent_executor(conversation_id: str) -> AgentExecutor:
+    memory = ConversationBufferMemory(
+        memory_key="chat_history",
+        return_messages=True,
+        chat_memory=SQLChatMessageHistory(session_id=conversation_id, connection=history_engine)
+    )
+
+    # Stop calling tools in time to write a partial answer before the turn deadline
+    remaining = llm_client.remaining()
+    max_execution_time = None if remaining is None else max(0.0, remaining - Config.TURN_FINAL_ANSWER_SECONDS)
+
+    return AgentExecutor(
+        agent=agent,
+        verbose=True,
+        tools=tools,
+        memory=memory,
+        max_execution_time=max_execution_time,
+        early_stopping_method="generate"
+    )
+
+
+def run_turn(conversation_id: str, user_input: str, deadline: float):
+    # Turns of the same conversation run one at a time, whichever worker receives them
+    with llm_client.deadline_scope(deadline), \
+            lease(f"conversation:{conversation_id}", ttl=Config.TURN_LEASE_SECONDS):
+        try:
+            return build_agent_executor(conversation_id)(user_input)
+        except Exception as err:
+            if llm_client.ran_out_of_time(err):
+                return {"output": "Sorry, I ran out of time answering this. Please try a narrower question."}
+            raise
 
 
 
@@ -112,8 +156,12 @@ class LangChainBot(ActivityHandler):
     async def on_message_activity(self, turn_context: TurnContext):
         user_id = turn_context.activity.from_property.id
         user_input = turn_context.activity.text
+        conversation_id = turn_context.activity.conversation.id
+        deadline = time.monotonic() + Config.TURN_DEADLINE_SECONDS
 
-        conversation = agent_executor(user_input)
+        # Run the agent off the event loop so other turns (and redeliveries) are still served
+        loop = asyncio.get_running_loop()
+        conversation = await loop.run_in_executor(None, run_turn, conversation_id, user_input, deadline)
         response = conversation['output']
 
         if isinstance(response, str):
@@ -150,6 +198,27 @@ class LangChainBot(ActivityHandler):
 
 
 ### 4. Adapter settings ====================
+# Activity IDs already being processed or done by any worker, to drop channel redeliveries
+seen_activities = SharedTTLCache("activity", maxsize=Config.ACTIVITY_CACHE_SIZE, ttl=Config.ACTIVITY_CACHE_TTL)
+
+def activity_key(activity: Activity):
+    if not activity.id:
+        return None
+    conversation_id = activity.conversation.id if activity.conversation else ""
+    return f"{conversation_id}:{activity.id}"
+
+# seen_activities reads and writes state.db, which can wait up to its busy timeout on other
+# workers. Run those calls off the event loop, and apart from the agent turns in the default executor
+state_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="state")
+
+async def claim_activity(key: str) -> bool:
+    """False if another delivery of this activity was already claimed by any worker."""
+    return await asyncio.get_running_loop().run_in_executor(state_executor, seen_activities.add, key)
+
+async def forget_activity(key: str):
+    await asyncio.get_running_loop().run_in_executor(state_executor, seen_activities.discard, key)
+
+
 adapter_settings = BotFrameworkAdapterSettings(
     app_id=Config.APP_ID,
     app_password=Config.APP_PASSWORD,
@@ -167,6 +236,11 @@ async def on_error(turn_context: TurnContext, error: Exception):
     print(f"\n [on_turn_error] unhandled error: {error}", file=sys.stderr)
     traceback.print_exc()
 
+    # Forget the activity so the channel's retry of this failed turn is processed
+    key = activity_key(turn_context.activity)
+    if key:
+        await forget_activity(key)
+
     # Send a message to the user
     await turn_context.send_activity("The bot encountered an error or bug.")
 
@@ -0,0 +1,225 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+
+import httpx
+
+from config import Config
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Absolute time.monotonic() by which the current Teams turn must be answered
+turn_deadline = contextvars.ContextVar("turn_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# ---------- Turn deadline ----------
+def remaining():
+    """Seconds left in the current turn, or None outside of a turn."""
+    deadline = turn_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def deadline_passed() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def ran_out_of_time(error: BaseException) -> bool:
+    """
+    Whether `error` ended the turn because of its deadline: the deadline has passed, or
+    DeadlineExceeded is in the exception chain (openai re-raises it as APIConnectionError).
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, DeadlineExceeded):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return deadline_passed()
+
+
+@contextlib.contextmanager
+def deadline_scope(deadline: float):
+    token = turn_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        turn_deadline.reset(token)
+
+
+def respect_deadline(tool):
+    """Return a copy of a LangChain tool that is skipped when the turn is nearly out of time."""
+    @functools.wraps(tool.func)
+    def func(*args, **kwargs):
+        left = remaining()
+        if left is not None and left < Config.TOOL_MIN_SECONDS:
+            return f"Skipped {tool.name}: not enough time left in this turn. Answer with what you already have."
+        return tool.func(*args, **kwargs)
+
+    return type(tool).from_function(
+        func=func,
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema
+    )
+
+
+# ---------- Rate limiting ----------
+class TokenBucket:
+    """Thread-safe token bucket; reserve() hands out tokens in arrival order."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take one token and return how many seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+# The OpenAI quota is for the whole deployment; split it across gunicorn workers
+workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+requests_per_second = Config.OPENAI_REQUESTS_PER_MINUTE / 60 / workers
+rate_limiter = TokenBucket(rate=requests_per_second, capacity=max(1.0, requests_per_second * Config.OPENAI_BURST_SECONDS))
+
+
+# ---------- Retry with jittered backoff ----------
+def _retry_delay(attempt: int, response=None) -> float:
+    if response is not None:
+        headers = response.headers
+        for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+            try:
+                return float(headers[name]) * scale
+            except (KeyError, ValueError):
+                continue
+    # Full jitter
+    return random.uniform(0, min(Config.LLM_RETRY_MAX_DELAY, Config.LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def _can_retry(attempt: int, delay: float) -> bool:
+    left = remaining()
+    return attempt < Config.LLM_MAX_RETRIES and (left is None or delay < left)
+
+
+def _reserve_slot() -> float:
+    wait = rate_limiter.reserve()
+    left = remaining()
+    if left is not None and wait >= left:
+        rate_limiter.refund()
+        raise DeadlineExceeded("turn deadline reached while waiting for the OpenAI rate limit")
+    return wait
+
+
+def _apply_deadline(request: httpx.Request):
+    """Cap every phase of the request timeout to the time left in the turn."""
+    left = remaining()
+    if left is None:
+        return
+    if left <= 0:
+        raise DeadlineExceeded("turn deadline reached before calling OpenAI")
+    timeouts = request.extensions.get("timeout", {})
+    request.extensions["timeout"] = {
+        phase: left if timeouts.get(phase) is None else min(timeouts[phase], left)
+        for phase in ("connect", "read", "write", "pool")
+    }
+
+
+class RetryTransport(httpx.BaseTransport):
+    """Rate-limited transport that retries 429/5xx and connection errors with jittered backoff."""
+
+    def __init__(self, **kwargs):
+        self._transport = httpx.HTTPTransport(**kwargs)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            time.sleep(_reserve_slot())
+            _apply_deadline(request)
+
+            try:
+                response = self._transport.handle_request(request)
+            except httpx.TransportError:
+                delay = _retry_delay(attempt)
+                if not _can_retry(attempt, delay):
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                delay = _retry_delay(attempt, response)
+                if not _can_retry(attempt, delay):
+                    return response
+                response.close()
+
+            print(f"[llm_client] retry {attempt + 1} in {delay:.2f}s", flush=True)
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncRetryTransport(httpx.AsyncBaseTransport):
+    """Async counterpart of RetryTransport."""
+
+    def __init__(self, **kwargs):
+        self._transport = httpx.AsyncHTTPTransport(**kwargs)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            await asyncio.sleep(_reserve_slot())
+            _apply_deadline(request)
+
+            try:
+                response = await self._transport.handle_async_request(request)
+            except httpx.TransportError:
+                delay = _retry_delay(attempt)
+                if not _can_retry(attempt, delay):
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                delay = _retry_delay(attempt, response)
+                if not _can_retry(attempt, delay):
+                    return response
+                await response.aclose()
+
+            print(f"[llm_client] retry {attempt + 1} in {delay:.2f}s", flush=True)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+# ---------- Pooled clients ----------
+limits = httpx.Limits(
+    max_connections=Config.LLM_MAX_CONNECTIONS,
+    max_keepalive_connections=Config.LLM_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=Config.LLM_KEEPALIVE_EXPIRY
+)
+timeout = httpx.Timeout(Config.LLM_TIMEOUT, connect=Config.LLM_CONNECT_TIMEOUT)
+
+http_client = httpx.Client(timeout=timeout, transport=RetryTransport(limits=limits))
+async_http_client = httpx.AsyncClient(timeout=timeout, transport=AsyncRetryTransport(limits=limits))
@@ -1,12 +1,17 @@
 from tools.sql import list_tables
+from tools.rollup import describe_rollups
 
 tables = list_tables()
 
 SYSTEM_MESSAGE = "You are an AI that has access to a SQLite database.\n" \
                  "The database has tables of: {tables}\n" \
                  "Do not make any assumptions about what tables exist " \
-                 "or what columns exist. Instead, use the 'describe_tables' function" \
+                 "or what columns exist. Instead, use the 'describe_tables' function. " \
+                 "These pre-aggregated rollup tables are kept up to date:\n{rollups}\n" \
+                 "Prefer querying a rollup table over joining orders, order_products and products " \
+                 "for daily/monthly order totals or per-user lifetime spend. " \
                  "IMPORTANT: When you create a chart using the plot_chart tool, " \
                  "you MUST include the path to the generated image file in your final response in this exact format: Image Path: <path_to_image>" \
                  "Do not remove or rewrite this path later." \
                  "Result of tool run_sqlite_query must be printed out, do not remove it"
+SYSTEM_MESSAGE = SYSTEM_MESSAGE.format(tables=tables, rollups=describe_rollups())
@@ -0,0 +1,216 @@
+# State shared by all gunicorn workers, without outside services:
+# a WAL-mode SQLite file for caches and leases, and
+# read-only memory-mapped .npy files for fitted model artefacts.
+import contextlib
+import functools
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from config import Config
+
+os.makedirs(Config.STATE_DIR, exist_ok=True)
+STATE_DB = os.path.join(Config.STATE_DIR, "state.db")
+STATE_DB_URL = f"sqlite:///{STATE_DB}"
+MODELS_DIR = os.path.join(Config.STATE_DIR, "models")
+
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB,
+    expires REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+local = threading.local()
+
+
+def get_conn() -> sqlite3.Connection:
+    """One autocommit connection per thread."""
+    conn = getattr(local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(STATE_DB, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        local.conn = conn
+    return conn
+
+
+# ---------- Key/value cache with TTL ----------
+class SharedTTLCache:
+    """Bounded map whose entries expire after `ttl` seconds, visible to every worker."""
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._writes = 0
+
+    def _prune(self, conn, now):
+        conn.execute("DELETE FROM kv WHERE namespace = ? AND expires <= ?", (self.namespace, now))
+        conn.execute("""
+            DELETE FROM kv WHERE namespace = ? AND key NOT IN (
+                SELECT key FROM kv WHERE namespace = ? ORDER BY expires DESC LIMIT ?
+            )""", (self.namespace, self.namespace, self.maxsize))
+
+    def _written(self, conn, now):
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune(conn, now)
+
+    def get(self, key, default=None):
+        row = get_conn().execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND expires > ?",
+            (self.namespace, key, time.time())
+        ).fetchone()
+        return pickle.loads(row[0]) if row else default
+
+    def add(self, key, value=True) -> bool:
+        """Insert key if absent. Returns False when it is already present (check-and-set)."""
+        conn, now = get_conn(), time.time()
+        conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ? AND expires <= ?", (self.namespace, key, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO kv (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+            (self.namespace, key, pickle.dumps(value), now + self.ttl)
+        )
+        self._written(conn, now)
+        return cursor.rowcount == 1
+
+    def set(self, key, value):
+        conn, now = get_conn(), time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO kv (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+            (self.namespace, key, pickle.dumps(value), now + self.ttl)
+        )
+        self._written(conn, now)
+
+    def discard(self, key):
+        get_conn().execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+
+# ---------- Cross-worker leases ----------
+@contextlib.contextmanager
+def lease(name: str, ttl: float, poll: float = 0.05):
+    """Block until this thread holds the named lease; it expires after `ttl` if the holder dies."""
+    conn = get_conn()
+    owner = f"{WORKER_ID}:{threading.get_ident()}"
+
+    while True:
+        now = time.time()
+        conn.execute("DELETE FROM leases WHERE name = ? AND expires <= ?", (name, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO leases (name, owner, expires) VALUES (?, ?, ?)",
+            (name, owner, now + ttl)
+        )
+        if cursor.rowcount == 1:
+            break
+        time.sleep(poll)
+
+    try:
+        yield
+    finally:
+        conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+
+def memoize(ttl: float, version=None):
+    """
+    Share a function's results across workers for `ttl` seconds. Concurrent misses
+    for the same arguments compute once; `version` (callable) is mixed into the key.
+    """
+    def decorator(func):
+        name = f"result:{func.__module__}.{func.__qualname__}"
+        results = SharedTTLCache(name, maxsize=Config.RESULT_CACHE_SIZE, ttl=ttl)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = repr((version() if version else None, args, sorted(kwargs.items())))
+            hit = results.get(key)
+            if hit is not None:
+                return hit
+
+            with lease(f"{name}:{key}", ttl=Config.MODEL_BUILD_LEASE_SECONDS):
+                hit = results.get(key)
+                if hit is not None:
+                    return hit
+                value = func(*args, **kwargs)
+                results.set(key, value)
+                return value
+        return wrapper
+    return decorator
+
+
+# ---------- Model artefacts (read-only, memory-mapped) ----------
+def _model_dir(name, version):
+    return os.path.join(MODELS_DIR, name, version)
+
+
+def load_arrays(name: str, version: str):
+    path = _model_dir(name, version)
+    if not os.path.isdir(path):
+        return None
+    return {
+        filename[:-4]: np.load(os.path.join(path, filename), mmap_mode="r")
+        for filename in os.listdir(path) if filename.endswith(".npy")
+    }
+
+
+def save_arrays(name: str, version: str, arrays):
+    path = _model_dir(name, version)
+    tmp_path = f"{path}.tmp-{WORKER_ID}"
+    os.makedirs(tmp_path, exist_ok=True)
+    for key, value in arrays.items():
+        np.save(os.path.join(tmp_path, f"{key}.npy"), np.asarray(value))
+
+    # Publish atomically; another worker may have won the race
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+    _remove_stale_versions(name, keep=version)
+
+
+def _remove_stale_versions(name: str, keep: str):
+    """
+    Delete every other version of a model, and temp dirs left by builders that died.
+    Called under the model's build lease, so no other worker is writing here. Workers
+    still mapping an old version keep its pages until they unmap them.
+    """
+    parent = os.path.join(MODELS_DIR, name)
+    for entry in os.listdir(parent):
+        if entry != keep:
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+
+
+def shared_arrays(name: str, version: str, build):
+    """
+    Load model arrays for `version` memory-mapped, building them in exactly one
+    worker if they do not exist yet. N workers share the same page cache.
+    """
+    arrays = load_arrays(name, version)
+    if arrays is not None:
+        return arrays
+
+    with lease(f"model:{name}", ttl=Config.MODEL_BUILD_LEASE_SECONDS):
+        arrays = load_arrays(name, version)
+        if arrays is None:
+            save_arrays(name, version, build())
+            arrays = load_arrays(name, version)
+    return arrays
+
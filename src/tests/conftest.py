@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Modules import each other as top-level names from src/, as when the app runs
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import llm_client
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """Answers with the scripted (status, headers) responses in order, then 200."""
+    script = []
+    received = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        ScriptedHandler.received.append(time.monotonic())
+        status, headers = ScriptedHandler.script.pop(0) if ScriptedHandler.script else (200, {})
+        body = b'{"ok": true}'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ScriptedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def reset(monkeypatch):
+    ScriptedHandler.script = []
+    ScriptedHandler.received = []
+    # Generous limit unless a test sets its own
+    monkeypatch.setattr(llm_client, "rate_limiter", llm_client.TokenBucket(rate=1000, capacity=1000))
+
+
+def post(url):
+    with httpx.Client(transport=llm_client.RetryTransport()) as client:
+        return client.post(url, json={})
+
+
+def test_retries_429_and_5xx(server_url):
+    ScriptedHandler.script = [(429, {"retry-after": "0"}), (503, {"retry-after-ms": "0"}), (502, {"retry-after": "0"})]
+
+    response = post(server_url)
+
+    assert response.status_code == 200
+    assert len(ScriptedHandler.received) == 4
+
+
+def test_does_not_retry_client_errors(server_url):
+    ScriptedHandler.script = [(400, {})]
+
+    assert post(server_url).status_code == 400
+    assert len(ScriptedHandler.received) == 1
+
+
+def test_honours_retry_after(server_url):
+    ScriptedHandler.script = [(429, {"retry-after": "0.3"})]
+
+    assert post(server_url).status_code == 200
+    first, second = ScriptedHandler.received
+    assert second - first >= 0.3
+
+
+def test_gives_up_after_max_retries(server_url, monkeypatch):
+    monkeypatch.setattr(llm_client.Config, "LLM_MAX_RETRIES", 2)
+    ScriptedHandler.script = [(503, {"retry-after": "0"})] * 5
+
+    assert post(server_url).status_code == 503
+    assert len(ScriptedHandler.received) == 3
+
+
+def test_returns_error_when_retry_after_exceeds_deadline(server_url):
+    ScriptedHandler.script = [(429, {"retry-after": "5"})]
+
+    start = time.monotonic()
+    with llm_client.deadline_scope(start + 1):
+        response = post(server_url)
+
+    assert response.status_code == 429
+    assert len(ScriptedHandler.received) == 1
+    assert time.monotonic() - start < 1
+
+
+def test_raises_when_deadline_already_passed(server_url):
+    with llm_client.deadline_scope(time.monotonic() - 1):
+        with pytest.raises(llm_client.DeadlineExceeded):
+            post(server_url)
+
+    assert ScriptedHandler.received == []
+
+
+def test_waits_for_rate_limit(server_url, monkeypatch):
+    monkeypatch.setattr(llm_client, "rate_limiter", llm_client.TokenBucket(rate=5, capacity=1))
+
+    start = time.monotonic()
+    for _ in range(3):
+        assert post(server_url).status_code == 200
+
+    # One token is available at once, the next two come 0.2s apart
+    assert time.monotonic() - start >= 0.35
+    assert len(ScriptedHandler.received) == 3
+
+
+def test_rate_limit_wait_respects_deadline(server_url, monkeypatch):
+    monkeypatch.setattr(llm_client, "rate_limiter", llm_client.TokenBucket(rate=0.5, capacity=1))
+    assert post(server_url).status_code == 200
+
+    # The next token is 2s away, past the deadline: fail fast and give the token back
+    with llm_client.deadline_scope(time.monotonic() + 0.5):
+        with pytest.raises(llm_client.DeadlineExceeded):
+            post(server_url)
+
+    assert len(ScriptedHandler.received) == 1
+    assert llm_client.rate_limiter.tokens >= 0
+
+
+def test_async_transport_retries(server_url):
+    ScriptedHandler.script = [(429, {"retry-after": "0.1"}), (500, {"retry-after": "0"})]
+
+    async def run():
+        async with httpx.AsyncClient(transport=llm_client.AsyncRetryTransport()) as client:
+            return await client.post(server_url, json={})
+
+    assert asyncio.run(run()).status_code == 200
+    assert len(ScriptedHandler.received) == 3
+
+
+def test_rate_limit_deadline_is_recognised_through_openai(server_url, monkeypatch):
+    openai = pytest.importorskip("openai")
+    monkeypatch.setattr(llm_client, "rate_limiter", llm_client.TokenBucket(rate=0.5, capacity=1))
+    llm_client.rate_limiter.reserve()
+
+    client = openai.OpenAI(
+        api_key="test",
+        base_url=server_url.rsplit("/chat/completions", 1)[0],
+        http_client=httpx.Client(transport=llm_client.RetryTransport()),
+        max_retries=0
+    )
+    # The deadline has not passed yet, but the rate-limit wait is longer than what is left
+    with llm_client.deadline_scope(time.monotonic() + 1):
+        # openai 1.x wraps transport exceptions in APIConnectionError, later versions may not
+        with pytest.raises((openai.APIConnectionError, llm_client.DeadlineExceeded)) as raised:
+            client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "hi"}])
+        assert not llm_client.deadline_passed()
+        assert llm_client.ran_out_of_time(raised.value)
+
+    assert not llm_client.ran_out_of_time(ValueError("unrelated"))
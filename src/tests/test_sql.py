@@ -0,0 +1,91 @@
+import importlib
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from tools import output
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class WordEncoding:
+    """Stand-in for the tiktoken encoding (one token per word), which needs a download."""
+
+    def encode(self, text):
+        return text.split(" ")
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+@pytest.fixture(scope="module")
+def sql(tmp_path_factory):
+    # tools.sql opens db.sqlite in the working directory; use a copy
+    directory = tmp_path_factory.mktemp("db")
+    shutil.copy(os.path.join(SRC, "db.sqlite"), directory / "db.sqlite")
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield importlib.import_module("tools.sql")
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(autouse=True)
+def word_encoding(monkeypatch):
+    monkeypatch.setattr(output, "encoding", WordEncoding())
+
+
+def test_join_keeps_duplicate_columns(sql):
+    result = sql.run_sqlite_query(
+        "SELECT * FROM orders o JOIN order_products op ON op.order_id = o.id WHERE op.id = 1"
+    )
+    order_id = sql.conn.execute("SELECT order_id FROM order_products WHERE id = 1").fetchone()[0]
+
+    assert result["columns"] == ["id", "user_id", "created", "id", "order_id", "product_id", "amount"]
+    [row] = result["rows"]
+    assert row[0] == order_id
+    assert row[3] == 1
+
+    header, line = output.encode_output(result, 200).split("\n")
+    assert header == "id|user_id|created|id|order_id|product_id|amount"
+    assert line.split("|")[:4] == [str(order_id), str(row[1]), row[2], "1"]
+
+
+def test_truncated_result_keeps_footer(sql):
+    result = sql.run_sqlite_query("SELECT * FROM order_products")
+
+    assert len(result["rows"]) == sql.Config.QUERY_ROW_LIMIT
+    encoded = output.encode_output(result, 1500)
+
+    assert encoded.startswith("note: results truncated")
+    assert "more rows omitted (1000 rows total)" in encoded
+    assert "all rows: id: min=" in encoded
+    assert "[truncated" not in encoded
+    assert output.count_tokens(encoded) <= 1500
+
+
+def test_empty_result_keeps_header(sql):
+    result = sql.run_sqlite_query("SELECT id, name FROM users WHERE id < 0")
+
+    assert output.encode_output(result, 100) == "id|name\n(0 rows)"
+
+
+def test_writes_are_rejected_without_holding_the_lock(sql):
+    before = sql.conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+    result = sql.run_sqlite_query("INSERT INTO orders (user_id, created) VALUES (1, '2024-01-01')")
+
+    assert result.startswith("The following error occured") and "readonly" in result
+    assert not sql.conn.in_transaction
+    assert sql.conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0] == before
+
+    # Another worker can still take the write lock, e.g. to refresh the rollups
+    other = sqlite3.connect("db.sqlite", timeout=0)
+    try:
+        other.execute("BEGIN IMMEDIATE")
+        other.rollback()
+    finally:
+        other.close()
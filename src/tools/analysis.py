@@ -1,25 +1,61 @@
+import os
 import sqlite3
+import threading
 from pydantic.v1 import BaseModel
 from typing import List, Dict, Any
-from langchain.tools import Tool
+from langchain.tools import Tool, StructuredTool
 from lifetimes import BetaGeoFitter, GammaGammaFitter
 from lifelines import CoxPHFitter
 from sklearn.ensemble import RandomForestClassifier
 from sklift.models import ClassTransformation
+import numpy as np
 import pandas as pd
 from causalnex.structure.notears import from_pandas
 from sklearn.preprocessing import StandardScaler
 
-# SQLite connection
-conn = sqlite3.connect("bank.db")
+from cache import single_flight
+from config import Config
+from state import memoize, shared_arrays
+
+# SQLite connection, shared by the agent threads
+conn = sqlite3.connect("bank.db", check_same_thread=False)
+conn_lock = threading.Lock()
+
+def load_customer_data() -> pd.DataFrame:
+    with conn_lock:
+        return pd.read_sql_query("SELECT * FROM customer_data", conn)
+
 
 # Schema for tools with top K argument
 class TopKArgsSchema(BaseModel):
     k: int
 
-# ---------- Calculate CLV: Top K customers for upsell ----------
-def calculate_clv_top_k(k: int) -> List[Dict[str, Any]]:
-    df = pd.read_sql_query("SELECT * FROM customer_data", conn)
+
+
+# ---------- Precomputed model outputs, rebuilt when bank.db changes ----------
+# Arrays are saved once under STATE_DIR and memory-mapped read-only by every worker
+precomputed = {}
+
+def bank_db_version() -> str:
+    stat = os.stat("bank.db")
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+def get_precomputed(name, build):
+    version = bank_db_version()
+
+    cached = precomputed.get(name)
+    if cached is None or cached["version"] != version:
+        cached = precomputed[name] = {"version": version, "value": shared_arrays(name, version, build)}
+    return cached["value"]
+
+
+@single_flight
+def build_clv_cube() -> Dict[str, Any]:
+    """
+    Fit BG/NBD + Gamma-Gamma once and compute CLV for every horizon from 1 to
+    CLV_MAX_HORIZON_MONTHS months: clv[:, h - 1] is each customer's CLV over h months.
+    """
+    df = load_customer_data()
 
     bgf = BetaGeoFitter(penalizer_coef=0.01)
     ggf = GammaGammaFitter(penalizer_coef=0.01)
@@ -30,33 +66,35 @@ def calculate_clv_top_k(k: int) -> List[Dict[str, Any]]:
     bgf.fit(df['frequency'], df['recency_months'], df['T_months'])
     ggf.fit(df['frequency'], df['monetary_value'])
 
-    clv = ggf.customer_lifetime_value(
-        bgf,
-        df['frequency'],
-        df['recency_months'],
-        df['T_months'],
-        df['monetary_value'],
-        time=12
+    # The model is fitted in months, so this is GammaGammaFitter.customer_lifetime_value
+    # with freq="M" (one step per month), accumulated once for all horizons
+    months = np.arange(1, Config.CLV_MAX_HORIZON_MONTHS + 1)
+    expected_purchases = np.column_stack([
+        bgf.predict(m, df['frequency'], df['recency_months'], df['T_months'])
+        for m in np.concatenate([[0], months])
+    ])
+    adjusted_monetary_value = ggf.conditional_expected_average_profit(
+        df['frequency'], df['monetary_value']
+    ).values
+
+    cash_flows = (
+        adjusted_monetary_value[:, None] * np.diff(expected_purchases, axis=1)
+        / (1 + Config.CLV_DISCOUNT_RATE) ** months[None, :]
     )
 
-    df['clv'] = clv
-
-    top_k = df[['customer_id', 'clv']].sort_values(by='clv', ascending=False).head(k)
-
-    return top_k.to_dict(orient='records')
-
-calculate_clv_tool = Tool.from_function(
-    name="calculate_clv_top_k",
-    description="Calculate Customer Lifetime Value (CLV) and get top K customers for upsell.",
-    func=calculate_clv_top_k,
-    args_schema=TopKArgsSchema
-)
-
+    return {
+        "customer_id": df['customer_id'].values,
+        "clv": np.cumsum(cash_flows, axis=1)
+    }
 
 
-# ---------- Survival Analysis: Time to churn for top K risky customers ----------
-def survival_analysis_top_k(k: int) -> List[Dict[str, Any]]:
-    df = pd.read_sql_query("SELECT * FROM customer_data", conn)
+@single_flight
+def build_survival_curves() -> Dict[str, Any]:
+    """
+    Fit the Cox model once and keep each customer's linear predictor with the baseline
+    survival function, so S(t | x) = S0(t) ** exp(lp) is an array lookup for any t.
+    """
+    df = load_customer_data()
 
     covariates = [
         "recency", "frequency", "monetary_value", "promotion_offer",
@@ -68,16 +106,99 @@ def survival_analysis_top_k(k: int) -> List[Dict[str, Any]]:
     cph = CoxPHFitter()
     cph.fit(df[["duration", "churned"] + covariates], duration_col="duration", event_col="churned")
 
-    expected_survival = cph.predict_expectation(df[covariates])
-    df["expected_survival"] = expected_survival
-    df["days_remaining_to_churn"] = (
-        df["expected_survival"] - df["duration"]
-    ).where(df["churned"] == 0, 0).clip(lower=0)
+    linear_predictor = np.asarray(cph.predict_log_partial_hazard(df[covariates])).ravel()
+    times = cph.baseline_survival_.index.values
+    baseline_survival = cph.baseline_survival_.iloc[:, 0].values
+
+    # Expected lifetime = area under each survival curve (as CoxPHFitter.predict_expectation)
+    curves = baseline_survival[None, :] ** np.exp(linear_predictor)[:, None]
+    expected_survival = np.trapz(curves, times, axis=1)
+
+    return {
+        "customer_id": df['customer_id'].values,
+        "duration": df['duration'].values,
+        "churned": df['churned'].values,
+        "linear_predictor": linear_predictor,
+        "times": times,
+        "baseline_survival": baseline_survival,
+        "expected_survival": expected_survival
+    }
+
+
+def _customer_index(customer_ids, customer_id):
+    matches = np.flatnonzero(customer_ids == customer_id)
+    return int(matches[0]) if len(matches) else None
+
+
+
+# ---------- Calculate CLV: Top K customers for upsell ----------
+class ClvTopKArgsSchema(BaseModel):
+    k: int
+    months: int = 12
+
+def calculate_clv_top_k(k: int, months: int = 12) -> List[Dict[str, Any]]:
+    if not 1 <= months <= Config.CLV_MAX_HORIZON_MONTHS:
+        return f"months must be between 1 and {Config.CLV_MAX_HORIZON_MONTHS}"
+
+    cube = get_precomputed("clv", build_clv_cube)
+
+    df = pd.DataFrame({
+        "customer_id": cube["customer_id"],
+        "clv": cube["clv"][:, months - 1]
+    })
+
+    top_k = df.sort_values(by='clv', ascending=False).head(k)
+
+    return top_k.to_dict(orient='records')
+
+calculate_clv_tool = StructuredTool.from_function(
+    name="calculate_clv_top_k",
+    description="Calculate Customer Lifetime Value (CLV) over the next `months` months (default 12) and get top K customers for upsell.",
+    func=calculate_clv_top_k,
+    args_schema=ClvTopKArgsSchema
+)
+
+
+class CustomerClvArgsSchema(BaseModel):
+    customer_id: int
+
+def customer_clv(customer_id: int) -> Dict[str, Any]:
+    cube = get_precomputed("clv", build_clv_cube)
+
+    i = _customer_index(cube["customer_id"], customer_id)
+    if i is None:
+        return f"Customer {customer_id} not found"
+
+    return {
+        "customer_id": customer_id,
+        "clv_by_months": [
+            {"months": h, "clv": float(cube["clv"][i, h - 1])}
+            for h in range(1, Config.CLV_MAX_HORIZON_MONTHS + 1)
+        ]
+    }
+
+customer_clv_tool = Tool.from_function(
+    name="customer_clv",
+    description="Get the CLV of one customer over every horizon from 1 month up to the maximum horizon.",
+    func=customer_clv,
+    args_schema=CustomerClvArgsSchema
+)
+
+
+
+# ---------- Survival Analysis: Time to churn for top K risky customers ----------
+def survival_analysis_top_k(k: int) -> List[Dict[str, Any]]:
+    curves = get_precomputed("survival", build_survival_curves)
+
+    df = pd.DataFrame({"customer_id": curves["customer_id"]})
+    df["days_remaining_to_churn"] = np.where(
+        curves["churned"] == 0,
+        np.clip(curves["expected_survival"] - curves["duration"], 0, None),
+        0
+    )
 
     # Customers with shortest days remaining are highest churn risk
-    top_k = df[['customer_id', 'days_remaining_to_churn']].sort_values(
-        by='days_remaining_to_churn'
-    ).head(k)
+    top_k = df.sort_values(by='days_remaining_to_churn').head(k)
 
     return top_k.to_dict(orient='records')
 
@@ -89,10 +210,38 @@ survival_analysis_tool = Tool.from_function(
 )
 
 
+class SurvivalProbabilityArgsSchema(BaseModel):
+    customer_id: int
+    day: float
+
+def survival_probability(customer_id: int, day: float) -> Dict[str, Any]:
+    curves = get_precomputed("survival", build_survival_curves)
+
+    i = _customer_index(curves["customer_id"], customer_id)
+    if i is None:
+        return f"Customer {customer_id} not found"
+
+    # Baseline survival is a step function: take the last step at or before `day`
+    step = np.searchsorted(curves["times"], day, side="right") - 1
+    baseline = curves["baseline_survival"][step] if step >= 0 else 1.0
+    probability = baseline ** np.exp(curves["linear_predictor"][i])
+
+    return {"customer_id": customer_id, "day": day, "survival_probability": float(probability)}
+
+survival_probability_tool = StructuredTool.from_function(
+    name="survival_probability",
+    description="Probability that a customer has not churned yet at a given day of their lifetime.",
+    func=survival_probability,
+    args_schema=SurvivalProbabilityArgsSchema
+)
+
+
 
 # ---------- Churn Classification: Top K customers with highest churn probability ----------
+@single_flight
+@memoize(ttl=Config.RESULT_CACHE_TTL, version=bank_db_version)
 def churn_classification_top_k(k: int) -> List[Dict[str, Any]]:
-    df = pd.read_sql_query("SELECT * FROM customer_data", conn)
+    df = load_customer_data()
 
     X = df.drop(columns=['churned'])
     y = df['churned']
@@ -117,8 +266,10 @@ churn_classification_tool = Tool.from_function(
 
 
 # ---------- Uplift Modeling: Count customers with positive uplift ----------
+@single_flight
+@memoize(ttl=Config.RESULT_CACHE_TTL, version=bank_db_version)
 def uplift_modeling_positive() -> Dict[str, Any]:
-    df = pd.read_sql_query("SELECT * FROM customer_data", conn)
+    df = load_customer_data()
 
     X = df.drop(columns=['churned'])
     y = df['churned']
@@ -143,8 +294,10 @@ uplift_modeling_tool = Tool.from_function(
 
 
 # ---------- Discover potential causal factors for churn ----------
+@single_flight
+@memoize(ttl=Config.RESULT_CACHE_TTL, version=bank_db_version)
 def discover_churn_factors() -> Dict[str, Any]:
-    df = pd.read_sql_query("SELECT * FROM customer_data", conn)
+    df = load_customer_data()
 
     demographic_cols = [
         "age", "income", "household_size",
@@ -0,0 +1,268 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+
+# Workload log: normalised query -> number of times it was run
+query_log = OrderedDict()
+log_lock = threading.Lock()
+# Total queries recorded, unaffected by eviction from the log
+recorded = 0
+# Held while a background tune is running
+tuning = threading.Lock()
+
+ALIAS_PATTERN = re.compile(
+    r"(?:\b(?:from|join)\s+|,\s*)([A-Za-z_]\w*)(?:\s+(?:as\s+)?([A-Za-z_]\w*))?",
+    re.IGNORECASE
+)
+PREDICATE_PATTERN = re.compile(
+    r"(?:([A-Za-z_]\w*)\.)?([A-Za-z_]\w*)\s*(?:=|<=|>=|<|>|\bin\b|\blike\b|\bbetween\b)",
+    re.IGNORECASE
+)
+REVERSE_PREDICATE_PATTERN = re.compile(
+    r"(?:=|<=|>=|<|>)\s*(?:([A-Za-z_]\w*)\.)?([A-Za-z_]\w*)",
+    re.IGNORECASE
+)
+# `a.x = b.y`: the right-hand side is an identifier, not a literal, function call or qualifier
+COLUMN_COMPARISON_PATTERN = re.compile(
+    r"(?:([A-Za-z_]\w*)\.)?([A-Za-z_]\w*)\s*(?:=|<=|>=|<|>)\s*(?:([A-Za-z_]\w*)\.)?([A-Za-z_]\w*)\b(?!\s*[(.])",
+    re.IGNORECASE
+)
+AUTOMATIC_INDEX_PATTERN = re.compile(r"^SEARCH (\w+) USING AUTOMATIC (?:COVERING |PARTIAL )*INDEX \((\w+)")
+SCAN_PATTERN = re.compile(r"^SCAN (\w+)")
+LOOP_PATTERN = re.compile(r"^(?:SCAN|SEARCH) (\w+)")
+
+SQL_KEYWORDS = {
+    "where", "on", "join", "inner", "left", "right", "outer", "cross", "natural",
+    "group", "order", "limit", "having", "union", "using", "select", "as"
+}
+
+
+# ---------- Recording ----------
+def record(query: str):
+    """Add a successfully executed SELECT to the workload log."""
+    normalised = " ".join(query.split()).rstrip(";")
+    if not normalised.lower().startswith(("select", "with")):
+        return
+
+    global recorded
+    with log_lock:
+        query_log[normalised] = query_log.pop(normalised, 0) + 1
+        while len(query_log) > Config.INDEX_ADVISOR_LOG_SIZE:
+            query_log.popitem(last=False)
+        recorded += 1
+
+
+def should_tune() -> bool:
+    return (
+        Config.INDEX_ADVISOR_MODE != "off"
+        and recorded > 0
+        and recorded % Config.INDEX_ADVISOR_EVERY == 0
+    )
+
+
+def workload():
+    """Snapshot of the workload log as (query, count) pairs."""
+    with log_lock:
+        return list(query_log.items())
+
+
+# ---------- Analysis ----------
+def _table_columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info('{table}')")}
+
+
+def _indexed_columns(conn, table):
+    """Columns that already lead an index, plus the rowid alias."""
+    indexed = {row[1] for row in conn.execute(f"PRAGMA table_info('{table}')") if row[5] == 1}
+    for index in conn.execute(f"PRAGMA index_list('{table}')"):
+        first = conn.execute(f"PRAGMA index_info('{index[1]}')").fetchone()
+        if first is not None:
+            indexed.add(first[2])
+    return indexed
+
+
+def resolve_aliases(query, tables):
+    aliases = {table: table for table in tables}
+    for table, alias in ALIAS_PATTERN.findall(query):
+        if table not in tables:
+            continue
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def _is_column(qualifier, column, aliases, columns):
+    if qualifier:
+        return qualifier in aliases and column in columns[aliases[qualifier]]
+    return any(column in table_columns for table_columns in columns.values())
+
+
+def predicate_columns(query, aliases, columns, joins=True):
+    """
+    Map table -> columns used in join or filter predicates. With joins=False,
+    columns compared against another column are left out, keeping only filters.
+    """
+    if not joins:
+        query = COLUMN_COMPARISON_PATTERN.sub(
+            lambda m: "" if _is_column(m.group(3), m.group(4), aliases, columns) else m.group(0),
+            query
+        )
+
+    used = {}
+    pairs = PREDICATE_PATTERN.findall(query) + REVERSE_PREDICATE_PATTERN.findall(query)
+    for qualifier, column in pairs:
+        if qualifier:
+            owners = [aliases[qualifier]] if qualifier in aliases else []
+        else:
+            owners = [t for t in set(aliases.values()) if column in columns[t]]
+        for table in owners:
+            if column in columns[table]:
+                used.setdefault(table, set()).add(column)
+    return used
+
+
+def analyse_query(conn, query):
+    """Return the (table, column) pairs whose missing index makes this query scan."""
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+    aliases = resolve_aliases(query, tables)
+    columns = {table: _table_columns(conn, table) for table in set(aliases.values())}
+    used = predicate_columns(query, aliases, columns)
+    filtered = predicate_columns(query, aliases, columns, joins=False)
+
+    plan = list(conn.execute("EXPLAIN QUERY PLAN " + query))
+    parents = {node: parent for node, parent, _, _ in plan}
+    details = {node: detail for node, _, _, detail in plan}
+
+    def correlated(node):
+        while node in parents:
+            if details[node].startswith("CORRELATED"):
+                return True
+            node = parents[node]
+        return False
+
+    missing = set()
+    nests = set()
+    for node, parent, _, detail in plan:
+        automatic = AUTOMATIC_INDEX_PATTERN.match(detail)
+        if automatic and automatic.group(1) in aliases:
+            missing.add((aliases[automatic.group(1)], automatic.group(2)))
+        if not LOOP_PATTERN.match(detail):
+            continue
+
+        # An inner loop (or a correlated subquery) runs once per outer row, so an index on
+        # its join columns turns each run into a lookup. The outermost loop of a nest is
+        # only helped by an index on columns compared against constants.
+        inner = parent in nests or correlated(parent)
+        nests.add(parent)
+
+        scan = SCAN_PATTERN.match(detail)
+        if scan and scan.group(1) in aliases:
+            table = aliases[scan.group(1)]
+            indexed = _indexed_columns(conn, table)
+            candidates = (used if inner else filtered).get(table, set())
+            for column in candidates - indexed:
+                missing.add((table, column))
+    return missing
+
+
+def advise(conn):
+    """Rank missing indexes by how many recorded queries would use them."""
+    recommendations = {}
+    for query, count in workload():
+        try:
+            missing = analyse_query(conn, query)
+        except Exception as err:
+            print(f"[index_advisor] skipped query ({err}): {query}", flush=True)
+            continue
+        for key in missing:
+            recommendations[key] = recommendations.get(key, 0) + count
+
+    return sorted(recommendations.items(), key=lambda item: item[1], reverse=True)
+
+
+# ---------- Apply ----------
+def _referenced_tables(query):
+    return {table.lower() for table, _ in ALIAS_PATTERN.findall(query)}
+
+
+def time_workload(conn, tables, repeat=3):
+    """
+    Total milliseconds to replay `repeat` times the recorded queries that touch
+    `tables`. Recorded queries already passed the query guard; rows are capped
+    at QUERY_ROW_LIMIT as for the agent.
+    """
+    tables = {table.lower() for table in tables}
+    queries = [query for query, _ in workload() if _referenced_tables(query) & tables]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            try:
+                conn.execute(query).fetchmany(Config.QUERY_ROW_LIMIT)
+            except Exception:
+                pass
+    return (time.perf_counter() - start) * 1000
+
+
+def tune(conn, mode=None):
+    """
+    Create the recommended indexes and report workload timings before and after.
+    mode: "advise" only reports, "allowlist" creates indexes listed in
+    Config.INDEX_ADVISOR_ALLOWLIST, "auto" creates every recommendation.
+    """
+    mode = mode or Config.INDEX_ADVISOR_MODE
+    recommendations = advise(conn)
+
+    if mode == "auto":
+        selected = [key for key, _ in recommendations]
+    elif mode == "allowlist":
+        allowed = set(Config.INDEX_ADVISOR_ALLOWLIST)
+        selected = [key for key, _ in recommendations if f"{key[0]}.{key[1]}" in allowed]
+    else:
+        selected = []
+
+    report = {
+        "recommended": [f"{table}.{column}" for (table, column), _ in recommendations],
+        "created": [],
+        "before_ms": None,
+        "after_ms": None
+    }
+    if not selected:
+        return report
+
+    tables = {table for table, _ in selected}
+    report["before_ms"] = round(time_workload(conn, tables), 2)
+    for table, column in selected:
+        index_name = f"idx_{table}_{column}"
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table}" ("{column}")')
+        report["created"].append(index_name)
+    conn.commit()
+    report["after_ms"] = round(time_workload(conn, tables), 2)
+
+    return report
+
+
+def tune_in_background(database: str):
+    """
+    Run tune() in a daemon thread on its own connection, so replaying the
+    workload never holds up the agent's queries. At most one tune runs at a time.
+    """
+    if not tuning.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            conn = sqlite3.connect(database)
+            try:
+                print(f"[index_advisor] {tune(conn)}", flush=True)
+            finally:
+                conn.close()
+        except Exception as err:
+            print(f"[index_advisor] tuning failed: {err}", flush=True)
+        finally:
+            tuning.release()
+
+    threading.Thread(target=run, daemon=True).start()
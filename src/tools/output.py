@@ -0,0 +1,179 @@
+import functools
+import math
+
+import tiktoken
+
+from config import Config
+
+encoding = None
+
+
+def get_encoding():
+    global encoding
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(Config.OPENAI_MODEL_NAME)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+    return encoding
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text))
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ""
+        if value == 0 or math.isinf(value):
+            return str(int(value)) if value == 0 else str(value)
+        # Keep small values (probabilities, weights) to significant digits,
+        # and at most TOOL_OUTPUT_FLOAT_DIGITS decimals on larger ones
+        integer_digits = max(0, math.floor(math.log10(abs(value))) + 1)
+        digits = max(Config.TOOL_OUTPUT_SIGNIFICANT_DIGITS, integer_digits + Config.TOOL_OUTPUT_FLOAT_DIGITS)
+        return f"{value:.{digits}g}"
+    if hasattr(value, "item"):
+        # numpy scalars
+        return _format_value(value.item())
+    return str(value)
+
+
+def _format_cell(value) -> str:
+    return _format_value(value).replace("\n", " ")
+
+
+def _is_table(value) -> bool:
+    return isinstance(value, (list, tuple)) and len(value) > 0 and all(
+        isinstance(row, (dict, list, tuple)) for row in value
+    )
+
+
+def _is_column_table(value) -> bool:
+    """{"columns": [...], "rows": [[...], ...]}, as returned by run_sqlite_query."""
+    return (
+        isinstance(value, dict)
+        and isinstance(value.get("columns"), (list, tuple))
+        and isinstance(value.get("rows"), (list, tuple))
+    )
+
+
+def _columns_and_values(rows, columns=None):
+    """Column names (None if unknown) and rows as lists of values."""
+    if rows and isinstance(rows[0], dict):
+        columns = list(rows[0].keys())
+        return columns, [[row.get(col) for col in columns] for row in rows]
+    return columns, [list(row) for row in rows]
+
+
+def _table_lines(columns, values):
+    """Header line (if columns are known) and one pipe-separated line per row."""
+    header = "|".join(columns) if columns else None
+    return header, ["|".join(_format_cell(value) for value in row) for row in values]
+
+
+def _summary(columns, values):
+    """min/mean/max of each numeric column, used when rows are dropped."""
+    if not columns:
+        return ""
+    parts = []
+    for i, column in enumerate(columns):
+        column_values = [row[i] for row in values]
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in column_values):
+            low, mean, high = (
+                _format_value(float(v))
+                for v in (min(column_values), sum(column_values) / len(column_values), max(column_values))
+            )
+            parts.append(f"{column}: min={low} mean={mean} max={high}")
+    return "; ".join(parts)
+
+
+def _encode_table(rows, budget, columns=None):
+    columns, values = _columns_and_values(rows, columns)
+    header, lines = _table_lines(columns, values)
+    kept = [header] if header else []
+    used = count_tokens(header) if header else 0
+    if not lines:
+        return "\n".join(kept + ["(0 rows)"])
+
+    costs = [count_tokens(line) + 1 for line in lines]
+    if used + sum(costs) <= budget:
+        return "\n".join(kept + lines)
+
+    summary = _summary(columns, values)
+
+    def footer(omitted):
+        text = f"... {omitted} more rows omitted ({len(lines)} rows total)"
+        return text + f"\nall rows: {summary}" if summary else text
+
+    # Reserve room for the truncation footer, so it is never what gets cut
+    reserve = count_tokens(footer(len(lines))) + 1
+    shown = 0
+    for cost in costs:
+        if used + cost > budget - reserve:
+            break
+        used += cost
+        shown += 1
+    return "\n".join(kept + lines[:shown] + [footer(len(lines) - shown)])
+
+
+def _truncate_text(text, budget):
+    tokens = get_encoding().encode(text)
+    if len(tokens) <= budget:
+        return text
+    return get_encoding().decode(tokens[:budget]) + f" ... [truncated, {len(tokens) - budget} more tokens]"
+
+
+def encode_output(result, budget: int) -> str:
+    """Compact header-plus-rows rendering of a tool result, fitted to a token budget."""
+    if _is_table(result):
+        return _encode_table(result, budget)
+
+    if isinstance(result, dict):
+        columns = result["columns"] if _is_column_table(result) else None
+        parts, used = [], 0
+        for key, value in result.items():
+            # Tables only get what earlier keys (e.g. a truncation note) left of the budget,
+            # so that the omitted-rows footer is never cut off
+            left = max(budget - used, 0)
+            if columns is not None and key == "columns":
+                continue
+            if columns is not None and key == "rows":
+                part = _encode_table(value, left, columns)
+            elif _is_table(value):
+                part = f"{key}:\n" + _encode_table(value, left)
+            else:
+                part = f"{key}: {_format_value(value)}"
+            parts.append(part)
+            used += count_tokens(part) + 1
+        text = "\n".join(parts)
+    else:
+        text = _format_value(result)
+
+    return _truncate_text(text, budget)
+
+
+def with_token_budget(tool):
+    """Return a copy of a LangChain tool whose output goes through encode_output."""
+    budget = Config.TOOL_TOKEN_BUDGETS.get(tool.name, Config.TOOL_TOKEN_BUDGET)
+
+    @functools.wraps(tool.func)
+    def func(*args, **kwargs):
+        result = tool.func(*args, **kwargs)
+        encoded = encode_output(result, budget)
+
+        raw_tokens = count_tokens(str(result))
+        encoded_tokens = count_tokens(encoded)
+        print(
+            f"[tool_output] {tool.name}: {raw_tokens} -> {encoded_tokens} tokens "
+            f"({raw_tokens - encoded_tokens} saved)",
+            flush=True
+        )
+        return encoded
+
+    return type(tool).from_function(
+        func=func,
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema
+    )
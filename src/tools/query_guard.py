@@ -0,0 +1,137 @@
+import re
+import time
+
+from config import Config
+from tools.index_advisor import resolve_aliases, SCAN_PATTERN
+
+SEARCH_PATTERN = re.compile(r"^SEARCH (\w+) USING (.*)$")
+LOOP_PATTERN = re.compile(r"^(?:SCAN|SEARCH) (\w+)")
+JOIN_PATTERN = re.compile(r"([A-Za-z_]\w*)\.\w+\s*=\s*([A-Za-z_]\w*)\.\w+")
+
+ROLLUP_SOURCES = {"orders", "order_products", "products"}
+
+# Cached per-table row estimates and columns, so the check stays well under a millisecond
+table_stats = {}
+table_stats_at = 0.0
+
+
+def _load_stats(conn):
+    global table_stats, table_stats_at
+
+    stats = {}
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+    for table in tables:
+        try:
+            # MAX(rowid) is an O(log n) estimate of the row count
+            rows = conn.execute(f'SELECT MAX(rowid) FROM "{table}"').fetchone()[0] or 0
+        except Exception:
+            rows = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info('{table}')")}
+        stats[table] = {"rows": rows, "columns": columns}
+
+    table_stats = stats
+    table_stats_at = time.monotonic()
+
+
+def _stats(conn):
+    if not table_stats or time.monotonic() - table_stats_at >= Config.QUERY_GUARD_STATS_SECONDS:
+        _load_stats(conn)
+    return table_stats
+
+
+def _loop_rows(detail, aliases, stats):
+    """Estimated rows visited by one loop of the query plan."""
+    scan = SCAN_PATTERN.match(detail)
+    if scan:
+        table = aliases.get(scan.group(1))
+        return stats[table]["rows"] if table in stats else 1
+
+    search = SEARCH_PATTERN.match(detail)
+    if search:
+        if "(rowid=?)" in search.group(2):
+            return 1
+        return Config.QUERY_GUARD_SEARCH_ROWS
+
+    return 1
+
+
+def estimate_cost(conn, query):
+    """
+    Estimate rows visited from EXPLAIN QUERY PLAN: nested loops under the same
+    parent multiply, independent subqueries add up, and a correlated subquery
+    runs once per row of the loop nest that encloses it.
+    Returns (cost, loops, aliases) where loops lists the table aliases of each loop nest.
+    """
+    stats = _stats(conn)
+    aliases = resolve_aliases(query, list(stats))
+
+    parents, details, nests = {}, {}, {}
+    for node, parent, _, detail in conn.execute("EXPLAIN QUERY PLAN " + query):
+        parents[node], details[node] = parent, detail
+        if not detail.startswith(("SCAN ", "SEARCH ")):
+            continue
+        nest = nests.setdefault(parent, {"cost": 1, "loops": []})
+        nest["cost"] *= _loop_rows(detail, aliases, stats)
+        nest["loops"].append(LOOP_PATTERN.match(detail).group(1))
+
+    def executions(node):
+        """How many times the loop nest under `node` runs."""
+        if node not in parents:
+            return 1
+        if details[node].startswith("CORRELATED"):
+            enclosing = parents[node]
+            return nests.get(enclosing, {"cost": 1})["cost"] * executions(enclosing)
+        return executions(parents[node])
+
+    cost = sum(nest["cost"] * executions(node) for node, nest in nests.items())
+    return cost, [nest["loops"] for nest in nests.values()], aliases
+
+
+def _unjoined(query, loops, aliases):
+    """Tables of a loop nest that no `a.x = b.y` predicate links to any other table."""
+    if len(loops) < 2 or re.search(r"\b(?:using\s*\(|natural\b)", query, re.IGNORECASE):
+        return []
+    joined = set()
+    for left, right in JOIN_PATTERN.findall(query):
+        if left != right:
+            joined.update((left, right))
+    return [loop for loop in loops if loop in aliases and loop not in joined]
+
+
+def check_query(conn, query):
+    """
+    Cost-based guard run before executing model-written SQL.
+    Returns (query, reason): reason is None when the query may run, otherwise
+    something the model can act on.
+    """
+    if not query.lstrip().lower().startswith(("select", "with")):
+        return query, None
+
+    try:
+        cost, loops, aliases = estimate_cost(conn, query)
+    except Exception:
+        # Let the real execution surface syntax errors to the model
+        return query, None
+
+    if cost > Config.QUERY_GUARD_CARTESIAN_ROWS:
+        for nest in loops:
+            unjoined = _unjoined(query, nest, aliases)
+            if unjoined:
+                tables = [aliases.get(loop, loop) for loop in nest]
+                return None, (
+                    f"the query joins {', '.join(tables)} without a join predicate on "
+                    f"{', '.join(aliases[loop] for loop in unjoined)}, which produces a cartesian product "
+                    f"(about {cost:,} rows visited). "
+                    "Add an ON / WHERE condition linking these tables (e.g. orders.user_id = users.id)."
+                )
+
+    if cost > Config.QUERY_GUARD_MAX_COST:
+        reason = (
+            f"the query is estimated to visit about {cost:,} rows "
+            f"(limit {Config.QUERY_GUARD_MAX_COST:,}). Add a selective WHERE condition or a LIMIT."
+        )
+        if ROLLUP_SOURCES & set(aliases.values()):
+            reason += " For daily/monthly totals or per-user spend, query the rollup_* tables instead."
+        return None, reason
+
+    return query, None
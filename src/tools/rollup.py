@@ -0,0 +1,225 @@
+import sqlite3
+import time
+
+from config import Config
+
+# Pre-aggregated summary tables over orders ⋈ order_products ⋈ products.
+# Description is shown to the agent so it can pick a rollup over the raw joins.
+ROLLUPS = {
+    "rollup_orders_daily": {
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS rollup_orders_daily (
+                day TEXT PRIMARY KEY,
+                num_orders INTEGER NOT NULL DEFAULT 0,
+                num_products INTEGER NOT NULL DEFAULT 0,
+                revenue REAL NOT NULL DEFAULT 0
+            )""",
+        "description": "one row per day (YYYY-MM-DD) with number of orders, number of products ordered and revenue"
+    },
+    "rollup_orders_monthly": {
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS rollup_orders_monthly (
+                month TEXT PRIMARY KEY,
+                num_orders INTEGER NOT NULL DEFAULT 0,
+                num_products INTEGER NOT NULL DEFAULT 0,
+                revenue REAL NOT NULL DEFAULT 0
+            )""",
+        "description": "one row per month (YYYY-MM) with number of orders, number of products ordered and revenue"
+    },
+    "rollup_user_lifetime": {
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS rollup_user_lifetime (
+                user_id INTEGER PRIMARY KEY,
+                num_orders INTEGER NOT NULL DEFAULT 0,
+                num_products INTEGER NOT NULL DEFAULT 0,
+                total_spent REAL NOT NULL DEFAULT 0,
+                first_order TEXT,
+                last_order TEXT
+            )""",
+        "description": "one row per user with lifetime number of orders, products ordered, total spent and first/last order dates"
+    }
+}
+
+# Internal bookkeeping table, hidden from the agent
+STATE_TABLE = "rollup_state"
+
+last_refresh = 0.0
+
+
+def describe_rollups() -> str:
+    return "\n".join(f"- {name}: {rollup['description']}" for name, rollup in ROLLUPS.items())
+
+
+def _ensure_tables(conn):
+    for rollup in ROLLUPS.values():
+        conn.execute(rollup["ddl"])
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            source TEXT PRIMARY KEY,
+            high_water INTEGER NOT NULL
+        )""")
+
+
+def _high_water(conn, source):
+    row = conn.execute(f"SELECT high_water FROM {STATE_TABLE} WHERE source = ?", (source,)).fetchone()
+    return row[0] if row else 0
+
+
+def _set_high_water(conn, source, value):
+    conn.execute(
+        f"INSERT INTO {STATE_TABLE} (source, high_water) VALUES (?, ?) "
+        "ON CONFLICT(source) DO UPDATE SET high_water = excluded.high_water",
+        (source, value)
+    )
+
+
+def _refresh_orders(conn):
+    """Fold orders inserted since the last refresh into the order counts."""
+    low = _high_water(conn, "orders")
+    high = conn.execute("SELECT MAX(rowid) FROM orders").fetchone()[0] or 0
+    if high <= low:
+        return 0
+
+    for table, key, expr in (
+        ("rollup_orders_daily", "day", "date(created)"),
+        ("rollup_orders_monthly", "month", "strftime('%Y-%m', created)")
+    ):
+        conn.execute(f"""
+            INSERT INTO {table} ({key}, num_orders)
+            SELECT {expr}, COUNT(*) FROM orders
+            WHERE rowid > ? AND rowid <= ?
+            GROUP BY 1
+            ON CONFLICT({key}) DO UPDATE SET num_orders = num_orders + excluded.num_orders
+        """, (low, high))
+
+    conn.execute("""
+        INSERT INTO rollup_user_lifetime (user_id, num_orders, first_order, last_order)
+        SELECT user_id, COUNT(*), MIN(created), MAX(created) FROM orders
+        WHERE rowid > ? AND rowid <= ?
+        GROUP BY user_id
+        ON CONFLICT(user_id) DO UPDATE SET
+            num_orders = num_orders + excluded.num_orders,
+            first_order = MIN(COALESCE(first_order, excluded.first_order), excluded.first_order),
+            last_order = MAX(COALESCE(last_order, excluded.last_order), excluded.last_order)
+    """, (low, high))
+
+    _set_high_water(conn, "orders", high)
+    return high - low
+
+
+def _refresh_order_products(conn):
+    """Fold order lines inserted since the last refresh into product counts and revenue."""
+    low = _high_water(conn, "order_products")
+    high = conn.execute("SELECT MAX(rowid) FROM order_products").fetchone()[0] or 0
+    if high <= low:
+        return 0
+
+    # Lines whose order has not landed yet are held back for ROLLUP_ORPHAN_WAIT_SECONDS,
+    # then skipped, so that an order_id that never arrives cannot stall the rollups
+    orphan = conn.execute("""
+        SELECT MIN(op.rowid) FROM order_products op
+        LEFT JOIN orders o ON o.id = op.order_id
+        WHERE op.rowid > ? AND op.rowid <= ? AND o.id IS NULL
+    """, (low, high)).fetchone()[0]
+    if orphan is not None:
+        now = int(time.time())
+        if _high_water(conn, "order_products_held") != orphan:
+            _set_high_water(conn, "order_products_held", orphan)
+            _set_high_water(conn, "order_products_held_since", now)
+
+        if now - _high_water(conn, "order_products_held_since") < Config.ROLLUP_ORPHAN_WAIT_SECONDS:
+            print(f"[rollup] holding back order lines from rowid {orphan}: their order is not there yet", flush=True)
+            high = min(high, orphan - 1)
+        else:
+            skipped = conn.execute("""
+                SELECT COUNT(*) FROM order_products op
+                LEFT JOIN orders o ON o.id = op.order_id
+                WHERE op.rowid > ? AND op.rowid <= ? AND o.id IS NULL
+            """, (low, high)).fetchone()[0]
+            print(
+                f"[rollup] skipping {skipped} order lines whose order never arrived; "
+                "run rebuild() if those orders are added later", flush=True
+            )
+    if high <= low:
+        return 0
+
+    lines = """
+        SELECT o.created AS created, o.user_id AS user_id, op.amount AS amount,
+               op.amount * COALESCE(p.price, 0) AS revenue
+        FROM order_products op
+        JOIN orders o ON o.id = op.order_id
+        LEFT JOIN products p ON p.id = op.product_id
+        WHERE op.rowid > ? AND op.rowid <= ?
+    """
+    for table, key, expr in (
+        ("rollup_orders_daily", "day", "date(created)"),
+        ("rollup_orders_monthly", "month", "strftime('%Y-%m', created)")
+    ):
+        conn.execute(f"""
+            INSERT INTO {table} ({key}, num_products, revenue)
+            SELECT {expr}, SUM(amount), SUM(revenue) FROM ({lines})
+            WHERE true
+            GROUP BY 1
+            ON CONFLICT({key}) DO UPDATE SET
+                num_products = num_products + excluded.num_products,
+                revenue = revenue + excluded.revenue
+        """, (low, high))
+
+    conn.execute(f"""
+        INSERT INTO rollup_user_lifetime (user_id, num_products, total_spent)
+        SELECT user_id, SUM(amount), SUM(revenue) FROM ({lines})
+        WHERE true
+        GROUP BY user_id
+        ON CONFLICT(user_id) DO UPDATE SET
+            num_products = num_products + excluded.num_products,
+            total_spent = total_spent + excluded.total_spent
+    """, (low, high))
+
+    _set_high_water(conn, "order_products", high)
+    return high - low
+
+
+def refresh(conn):
+    """
+    Incrementally bring the rollups up to date using rowid high-water marks.
+    Only inserts are picked up; call rebuild() after updating or deleting rows.
+    Returns None without touching conn while it has a transaction of its own open.
+    """
+    global last_refresh
+
+    if conn.in_transaction:
+        # Committing or rolling back here would end someone else's writes
+        return None
+
+    with conn:
+        # Take the write lock before reading the high-water marks so that
+        # concurrent workers cannot fold the same rows twice
+        conn.execute("BEGIN IMMEDIATE")
+        _ensure_tables(conn)
+        new_orders = _refresh_orders(conn)
+        new_lines = _refresh_order_products(conn)
+
+    last_refresh = time.monotonic()
+    return {"orders": new_orders, "order_products": new_lines}
+
+
+def refresh_if_stale(conn):
+    global last_refresh
+
+    if time.monotonic() - last_refresh < Config.ROLLUP_REFRESH_SECONDS:
+        return None
+    try:
+        return refresh(conn)
+    except sqlite3.OperationalError:
+        # Back off for a full interval instead of waiting on a busy database every call
+        last_refresh = time.monotonic()
+        raise
+
+
+def rebuild(conn):
+    """Drop and recompute every rollup from scratch."""
+    with conn:
+        for name in ROLLUPS:
+            conn.execute(f"DROP TABLE IF EXISTS {name}")
+        conn.execute(f"DROP TABLE IF EXISTS {STATE_TABLE}")
+    return refresh(conn)
@@ -1,25 +1,73 @@
 import sqlite3
+import threading
 from pydantic.v1 import BaseModel
 from typing import List
 from langchain.tools import Tool
 
-conn = sqlite3.connect("db.sqlite")
+from config import Config
+from tools import index_advisor, query_guard, rollup
+
+# Shared by the agent threads; conn_lock serialises access
+DATABASE = "db.sqlite"
+conn = sqlite3.connect(DATABASE, check_same_thread=False)
+conn_lock = threading.Lock()
+rollup.refresh(conn)
 
 
 def list_tables():
     c = conn.cursor()
     c.execute("SELECT name FROM sqlite_master WHERE type='table';")
     rows = c.fetchall()
-    return "\n".join(row[0] for row in rows if row[0] is not None)
+    return "\n".join(row[0] for row in rows if row[0] is not None and row[0] != rollup.STATE_TABLE)
 
 
 def run_sqlite_query(query):
-    c = conn.cursor()
-    try:
-        c.execute(query)
-        return c.fetchall()
-    except sqlite3.OperationalError as err:
-        return f"The following error occured: {str(err)}"
+    with conn_lock:
+        try:
+            rollup.refresh_if_stale(conn)
+        except sqlite3.OperationalError as err:
+            # e.g. another worker holds the write lock; retried after ROLLUP_REFRESH_SECONDS
+            print(f"[rollup] refresh failed: {err}", flush=True)
+
+        query, reason = query_guard.check_query(conn, query)
+        if reason:
+            return f"The query was rejected: {reason}"
+
+        c = conn.cursor()
+        try:
+            # Model-written SQL is read-only: a write would be left uncommitted and
+            # hold the database write lock, blocking rollups and index tuning in every worker
+            conn.execute("PRAGMA query_only = ON")
+            c.execute(query)
+            # Rows stay positional: joins often repeat column names (e.g. two `id`s)
+            columns = [column[0] for column in c.description or []]
+            # Fetch one row past the cap to know whether the result was cut off
+            rows = [list(row) for row in c.fetchmany(Config.QUERY_ROW_LIMIT + 1)]
+        except sqlite3.OperationalError as err:
+            return f"The following error occured: {str(err)}"
+        finally:
+            # Closing also ends the read of a partly fetched result; the rollback ends the
+            # transaction sqlite3 opens before a (refused) write. Both release their locks.
+            c.close()
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute("PRAGMA query_only = OFF")
+
+        index_advisor.record(query)
+        if index_advisor.should_tune():
+            index_advisor.tune_in_background(DATABASE)
+
+        if len(rows) > Config.QUERY_ROW_LIMIT:
+            # Note goes first so that the token budget never cuts it off
+            return {
+                "note": (
+                    f"results truncated at {Config.QUERY_ROW_LIMIT} rows; the query returned more. "
+                    "Aggregate or filter in SQL to answer from complete data."
+                ),
+                "columns": columns,
+                "rows": rows[:Config.QUERY_ROW_LIMIT]
+            }
+        return {"columns": columns, "rows": rows}
 
 
 class RunQueryArgsSchema(BaseModel):
@@ -28,16 +76,16 @@ class RunQueryArgsSchema(BaseModel):
 
 run_query_tool = Tool.from_function(
     name="run_sqlite_query",
-    description="Run a sqlite query.",
+    description=f"Run a read-only sqlite query. At most {Config.QUERY_ROW_LIMIT} rows are returned; larger results are marked as truncated.",
     func=run_sqlite_query,
     args_schema=RunQueryArgsSchema
 )
 
 
 def describe_tables(table_names):
-    c = conn.cursor()
     tables = ', '.join("'" + table + "'" for table in table_names)
-    rows = c.execute(f"SELECT sql FROM sqlite_master WHERE type='table' and name IN ({tables});")
+    with conn_lock:
+        rows = conn.execute(f"SELECT sql FROM sqlite_master WHERE type='table' and name IN ({tables});").fetchall()
     return '\n'.join(row[0] for row in rows if row[0] is not None)
 
 